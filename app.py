@@ -1,6 +1,10 @@
 import os
 import io
 import csv
+import asyncio
+import tempfile
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import xlsxwriter
 from flask import Flask, render_template, request, jsonify, send_file
@@ -12,7 +16,7 @@ load_dotenv()
 
 app = Flask(__name__)
 
-def get_cookies():
+def build_cookies():
     session_id = os.getenv("SESSION_ID")
     csrf_token = os.getenv("CSRF_TOKEN")
     if not session_id or not csrf_token:
@@ -23,6 +27,53 @@ def get_cookies():
         "csrftoken": csrf_token
     }
 
+# Environment doesn't change mid-process: resolve once and fail at startup
+COOKIES = build_cookies()
+
+def get_cookies():
+    return COOKIES
+
+# HTML parsing and ratio maths are CPU-bound; a shared pool keeps them off
+# the event loop without spinning up fresh threads on every /analyze
+executor = ThreadPoolExecutor(max_workers=16)
+
+def process_page(html, company_url, company):
+    bs, pnl = logic.parse_tables(html, company_url)
+    return logic.calculate_ratios(bs, pnl, company)
+
+async def analyze_companies(companies, cookies):
+    loop = asyncio.get_running_loop()
+
+    async def handle(company, session):
+        search = await logic.search_company(session, company)
+        if not search:
+            raise ValueError("Not found")
+
+        company_id, proper_name, company_url = search
+
+        # Scrape, then parse and calculate off the event loop
+        html = await logic.fetch_company_page(session, company_url)
+        return await loop.run_in_executor(executor, process_page, html, company_url, proper_name)
+
+    async with logic.create_session(cookies) as session:
+        outcomes = await asyncio.gather(
+            *[handle(c, session) for c in companies],
+            return_exceptions=True
+        )
+
+    all_results = []
+    errors = []
+
+    # gather keeps input order, so results stay grouped by company
+    for company, outcome in zip(companies, outcomes):
+        if isinstance(outcome, Exception):
+            # Client timeouts carry no message; fall back to the type
+            errors.append(f"{company}: {str(outcome) or type(outcome).__name__}")
+        else:
+            all_results.extend(outcome)
+
+    return all_results, errors
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -38,26 +89,7 @@ def analyze():
             return jsonify({"error": "No companies provided"}), 400
 
         cookies = get_cookies()
-        all_results = []
-        errors = []
-
-        for company in companies:
-            try:
-                search = logic.search_company(company, cookies)
-                if not search:
-                    errors.append(f"{company}: Not found")
-                    continue
-                
-                company_id, proper_name, company_url = search
-                
-                # Scrape and calculate
-                bs, pnl = logic.scrape_tables(company_url, cookies)
-                ratios = logic.calculate_ratios(bs, pnl, proper_name)
-                
-                all_results.extend(ratios)
-                
-            except Exception as e:
-                errors.append(f"{company}: {str(e)}")
+        all_results, errors = asyncio.run(analyze_companies(companies, cookies))
 
         return jsonify({
             "results": all_results,
@@ -76,9 +108,14 @@ def download():
         if not results:
             return jsonify({"error": "No data to download"}), 400
             
-        # Create Excel file in memory
+        # Stream rows to a temp file as they are written instead of
+        # holding the whole sheet in memory
         output = io.BytesIO()
-        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+        workbook = xlsxwriter.Workbook(output, {
+            'in_memory': False,
+            'constant_memory': True,
+            'tmpdir': tempfile.gettempdir()
+        })
         worksheet = workbook.add_worksheet("Ratios")
 
         # Formats
@@ -99,6 +136,17 @@ def download():
         for col, h in enumerate(raw_headers):
             worksheet.write(0, RAW_START_COL + col, "Raw " + h, header_fmt)
 
+        # Adjust widths. Number formats live on the columns so data rows
+        # can be written unformatted in one call; in constant_memory mode
+        # they must be set before any data row is flushed.
+        worksheet.set_column(0, 0, 25) # Company
+        worksheet.set_column(1, 1, 12) # Month
+        worksheet.set_column(2, 2, 12, num_fmt) # Debt/Equity
+        worksheet.set_column(3, 4, 12, pct_fmt) # OPM, ROCE
+        worksheet.set_column(5, 9, 2)  # Spacer (F-J hidden or narrow)
+        worksheet.set_column(10, 16, 15, num_fmt) # Raw Data
+        worksheet.set_column(17, 20, 15)
+
         # Prepare data for merging
         # Assumed results are already sorted/grouped by company from logic.py
         # But let's be safe and group them if needed or just iterate.
@@ -111,69 +159,66 @@ def download():
             'border': 1
         })
         
-        # We need to write data row by row, but merge Company column.
-        # Let's write all data first, then apply merges for Company column.
-        # Or track ranges.
-        
-        current_company = None
-        start_row = 1
-        
-        for row_idx, row_data in enumerate(results, start=1):
-            company = row_data.get("Company")
-            
-            # Write Month and Data (Cols B onwards)
-            worksheet.write(row_idx, 1, row_data.get("Month"))
-            
-            # Raw Data
-            raw_keys = [
-                "Raw_Borrowings", "Raw_Equity_Share_Capital", "Raw_Reserves", 
-                "Raw_Sales", "Raw_Operating_Profit", "Raw_Profit_before_tax", "Raw_Interest"
-            ]
-            
-            for i, key in enumerate(raw_keys):
-                val = row_data.get(key, 0)
-                if val is None: val = 0
-                worksheet.write_number(row_idx, RAW_START_COL + i, float(val), num_fmt)
-
-            # Formulas
-            excel_row = row_idx + 1
-            f_de = f'=IF((L{excel_row}+M{excel_row})<>0, K{excel_row}/(L{excel_row}+M{excel_row}), 0)'
-            worksheet.write_formula(row_idx, 2, f_de, num_fmt)
-
-            f_opm = f'=IF(N{excel_row}<>0, O{excel_row}/N{excel_row}, 0)'
-            worksheet.write_formula(row_idx, 3, f_opm, pct_fmt)
-
-            f_roce = f'=IF((L{excel_row}+M{excel_row}+K{excel_row})<>0, (P{excel_row}+Q{excel_row})/(L{excel_row}+M{excel_row}+K{excel_row}), 0)'
-            worksheet.write_formula(row_idx, 4, f_roce, pct_fmt)
-            
-            # Handle Merging Logic
-            if company != current_company:
-                # If we have a previous company to merge
-                if current_company is not None:
-                    end_row = row_idx - 1
-                    if start_row == end_row:
-                        worksheet.write(start_row, 0, current_company, merge_fmt)
-                    else:
-                        worksheet.merge_range(start_row, 0, end_row, 0, current_company, merge_fmt)
-                
-                # Start new block
-                current_company = company
-                start_row = row_idx
-
-        # Merge the last company/block
-        if current_company is not None:
-            end_row = len(results)
-            if start_row == end_row:
-                worksheet.write(start_row, 0, current_company, merge_fmt)
-            else:
-                worksheet.merge_range(start_row, 0, end_row, 0, current_company, merge_fmt)
-
-        # Adjust widths
-        worksheet.set_column(0, 0, 25) # Company
-        worksheet.set_column(1, 1, 12) # Month
-        worksheet.set_column(2, 4, 12) # Ratios
-        worksheet.set_column(5, 9, 2)  # Spacer (F-J hidden or narrow)
-        worksheet.set_column(10, 20, 15) # Raw Data
+        # constant_memory flushes each row once a later row is written, so
+        # the Company merge has to be registered on the first row of its
+        # block. Results arrive grouped by company from /analyze.
+        row_idx = 1
+
+        # Raw Data
+        raw_keys = [
+            "Raw_Borrowings", "Raw_Equity_Share_Capital", "Raw_Reserves",
+            "Raw_Sales", "Raw_Operating_Profit", "Raw_Profit_before_tax", "Raw_Interest"
+        ]
+
+        for company, block in groupby(results, key=lambda r: r.get("Company")):
+            block = list(block)
+            start_row = row_idx
+            end_row = start_row + len(block) - 1
+
+            for row_data in block:
+                # Company column: the merge itself is unformatted so it
+                # doesn't pad (and flush) the rows below; each row then
+                # writes its own formatted cell.
+                if row_idx == start_row:
+                    if start_row != end_row:
+                        worksheet.merge_range(start_row, 0, end_row, 0, company)
+                    worksheet.write(row_idx, 0, company, merge_fmt)
+                else:
+                    worksheet.write_blank(row_idx, 0, None, merge_fmt)
+
+                # Ratios use the same definitions (and 0 for a zero
+                # denominator) as the formulas on each company's first row,
+                # so every row of a column is computed the same way
+                raw = [float(row_data.get(key) or 0) for key in raw_keys]
+                borrowings, equity_cap, reserves, sales, op_profit, pbt, interest = raw
+                equity = equity_cap + reserves
+                capital_employed = equity + borrowings
+
+                # Month, ratios, spacer (F-J) and raw data in one call
+                worksheet.write_row(row_idx, 1, [
+                    row_data.get("Month"),
+                    borrowings / equity if equity != 0 else 0,
+                    op_profit / sales if sales != 0 else 0,
+                    (pbt + interest) / capital_employed if capital_employed != 0 else 0,
+                    None, None, None, None, None,
+                    *raw
+                ])
+
+                # Only the first row of each company keeps the ratio
+                # formulas so the derivation from the raw columns stays
+                # auditable; the rest carry the same values precomputed.
+                if row_idx == start_row:
+                    excel_row = row_idx + 1
+                    f_de = f'=IF((L{excel_row}+M{excel_row})<>0, K{excel_row}/(L{excel_row}+M{excel_row}), 0)'
+                    worksheet.write_formula(row_idx, 2, f_de)
+
+                    f_opm = f'=IF(N{excel_row}<>0, O{excel_row}/N{excel_row}, 0)'
+                    worksheet.write_formula(row_idx, 3, f_opm)
+
+                    f_roce = f'=IF((L{excel_row}+M{excel_row}+K{excel_row})<>0, (P{excel_row}+Q{excel_row})/(L{excel_row}+M{excel_row}+K{excel_row}), 0)'
+                    worksheet.write_formula(row_idx, 4, f_roce)
+
+                row_idx += 1
 
         workbook.close()
         output.seek(0)
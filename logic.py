@@ -1,18 +1,44 @@
 import re
-import requests
+import threading
+import httpx
+import lxml.html
+import numpy as np
 import pandas as pd
-from io import StringIO
+from collections import OrderedDict
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0",
     "Referer": "https://www.screener.in/"
 }
 
-def search_company(company_name, cookies):
+# Row labels carry a non-breaking space and a "+" expander
+LABEL_CHARS = str.maketrans({u'\xa0': ' ', '+': None})
+
+# Resolved (id, name, url) per normalized company name, oldest first
+SEARCH_CACHE_SIZE = 2048
+_search_cache = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+def create_session(cookies):
+    # One HTTP/2 client per batch: every request to screener.in is
+    # multiplexed over the same few connections instead of re-handshaking.
+    limits = httpx.Limits(max_connections=8, max_keepalive_connections=8)
+    return httpx.AsyncClient(
+        http2=True, limits=limits, timeout=15, headers=HEADERS, cookies=cookies,
+        follow_redirects=True
+    )
+
+async def search_company(session, company_name):
+    key = " ".join(company_name.split()).lower()
+    with _search_cache_lock:
+        if key in _search_cache:
+            _search_cache.move_to_end(key)
+            return _search_cache[key]
+
     url = "https://www.screener.in/api/company/search/"
     params = {"q": company_name, "v": 3, "fts": 1}
 
-    r = requests.get(url, params=params, headers=HEADERS, cookies=cookies, timeout=15)
+    r = await session.get(url, params=params)
     r.raise_for_status()
 
     data = r.json()
@@ -20,151 +46,168 @@ def search_company(company_name, cookies):
         return None
 
     top = data[0]
-    return top["id"], top["name"], top["url"]
+    result = top["id"], top["name"], top["url"]
 
+    with _search_cache_lock:
+        _search_cache[key] = result
+        if len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
 
-def scrape_tables(company_url, cookies):
-    url = f"https://www.screener.in{company_url}"
-    r = requests.get(url, headers=HEADERS, cookies=cookies, timeout=15)
+    return result
+
+
+async def fetch_company_page(session, company_url):
+    r = await session.get(f"https://www.screener.in{company_url}")
     r.raise_for_status()
+    return r.text
 
-    # Parse all tables
-    tables = pd.read_html(StringIO(r.text))
-
-    bs = None
-    pnl = None
-
-    # Identify tables by content
-    for i, df in enumerate(tables):
-        if df.empty: continue
-        
-        # Clean the first column to strict strings
-        first_col_raw = df.iloc[:, 0].astype(str).tolist()
-        first_col = [s.replace(u'\xa0', ' ').replace('+', '').strip() for s in first_col_raw]
-        
-        # Balance Sheet Keywords
-        if ("Equity Capital" in first_col or "Equity Share Capital" in first_col) and \
-           ("Borrowings" in first_col or "Total Liabilities" in first_col):
-            bs = df
-            continue
 
-        # Profit & Loss Keywords
-        if ("Sales" in first_col or "Revenue" in first_col) and \
-           ("Operating Profit" in first_col):
-            if pnl is None:
-                pnl = df
-            else:
-                pnl = df
+def parse_tables(html, company_url):
+    url = f"https://www.screener.in{company_url}"
+
+    # Screener anchors each statement in its own section
+    tree = lxml.html.fromstring(html)
+    bs = section_table(tree, "balance-sheet")
+    pnl = section_table(tree, "profit-loss")
 
     if bs is None or pnl is None:
         raise ValueError(f"Could not find Balance Sheet or P&L tables on {url}")
-    
-    # Pre-process: Set index to first column
-    bs.iloc[:, 0] = bs.iloc[:, 0].astype(str).str.replace(u'\xa0', ' ').str.replace('+', '').str.strip()
-    pnl.iloc[:, 0] = pnl.iloc[:, 0].astype(str).str.replace(u'\xa0', ' ').str.replace('+', '').str.strip()
-    
-    bs.set_index(bs.columns[0], inplace=True)
-    pnl.set_index(pnl.columns[0], inplace=True)
-    
+
+    bs = clean_table(bs)
+    pnl = clean_table(pnl)
+
+    # Make sure the sections hold the statements we need
+    if not (("Equity Capital" in bs.index or "Equity Share Capital" in bs.index
+             or "Share Capital" in bs.index) and "Borrowings" in bs.index) or \
+       not (("Sales" in pnl.index or "Revenue" in pnl.index)
+            and "Operating Profit" in pnl.index):
+        raise ValueError(f"Could not find Balance Sheet or P&L tables on {url}")
+
     # Remove duplicates
     pnl = pnl[~pnl.index.duplicated(keep='first')]
 
-    # Convert to numeric
-    for col in bs.columns:
-        if bs[col].dtype == object:
-             bs[col] = bs[col].astype(str).str.replace(',', '', regex=False)
-        bs[col] = pd.to_numeric(bs[col], errors='coerce')
-        
-    for col in pnl.columns:
-        if pnl[col].dtype == object:
-             pnl[col] = pnl[col].astype(str).str.replace(',', '', regex=False)
-             pnl[col] = pnl[col].astype(str).str.replace('%', '', regex=False)
-        pnl[col] = pd.to_numeric(pnl[col], errors='coerce')
-
     return bs, pnl
 
 
-def calculate_ratios(bs, pnl, company):
-    results = []
+def section_table(tree, section_id):
+    tables = tree.xpath(f'//section[@id="{section_id}"]//table')
+    if not tables:
+        return None
 
-    for col in bs.columns:
-        # Skip garbage columns
-        if pd.isna(col) or str(col).strip() == "":
-            continue
+    table = tables[0]
+    # lxml doesn't synthesise <thead>/<tbody>, so match rows by cell type
+    header = table.xpath('.//tr[th]')
+    columns = [th.text_content().strip() for th in header[0].xpath('./th')][1:] if header else []
 
-        try:
-            debt = bs.at["Borrowings", col]
-            
-            equity_key = "Equity Capital" if "Equity Capital" in bs.index else "Equity Share Capital"
-            if equity_key not in bs.index and "Share Capital" in bs.index:
-                equity_key = "Share Capital"
-            
-            equity = bs.at[equity_key, col] + bs.at["Reserves", col]
-
-            # P&L keys
-            sales_key = "Sales" if "Sales" in pnl.index else "Revenue"
-            revenue = pnl.at[sales_key, col]
-            
-            op_profit = pnl.at["Operating Profit", col]
-
-            # OPM
-            opm_key = "OPM %" if "OPM %" in pnl.index else "OPM"
-            
-            opm = None
-            if opm_key in pnl.index:
-               opm = pnl.at[opm_key, col]
-            
-            if pd.isna(opm):
-                opm = op_profit / revenue if revenue else None
-            else:
-                if isinstance(opm, (int, float, str)):
-                     try:
-                        val = float(str(opm).replace('%', ''))
-                        if val > 1: val = val / 100.0
-                        opm = val
-                     except:
-                        pass
-
-            # ROCE
-            # Approx Capital Employed = Equity + Debt.
-            # ROCE = EBIT / (Equity + Debt).
-            # EBIT = Net Profit + Tax + Interest (since PnL has Interest, Tax, Net Profit).
-            
-            pbt_key = "Profit before tax" if "Profit before tax" in pnl.index else None
-            int_key = "Interest" if "Interest" in pnl.index else None
-            
-            ebit = None
-            if pbt_key and int_key:
-                ebit = pnl.at[pbt_key, col] + pnl.at[int_key, col]
-            
-            roce = None
-            if ebit is not None and (equity + debt) > 0:
-                 roce = ebit / (equity + debt)
-
-            results.append({
-                "Company": company,
-                "Month": col,
-                "Debt_to_Equity": clean_val(debt / equity if equity else None),
-                "Operating_Profit_Margin": clean_val(opm),
-                "ROCE": clean_val(roce),
-                
-                # Raw Data for Formulas
-                "Raw_Borrowings": clean_val(debt),
-                "Raw_Equity_Share_Capital": clean_val(bs.at[equity_key, col]), 
-                "Raw_Reserves": clean_val(bs.at["Reserves", col]),
-                "Raw_Sales": clean_val(revenue),
-                "Raw_Operating_Profit": clean_val(op_profit),
-                "Raw_Profit_before_tax": clean_val(pnl.at[pbt_key, col]) if pbt_key else 0,
-                "Raw_Interest": clean_val(pnl.at[int_key, col]) if int_key else 0,
-                "Raw_Tax_Percent": clean_val(pnl.at["Tax %", col]) if "Tax %" in pnl.index else 0,
-                "Raw_Net_Profit": clean_val(pnl.at["Net Profit", col]) if "Net Profit" in pnl.index else 0,
-            })
-        except KeyError:
+    labels = []
+    rows = []
+    for tr in table.xpath('.//tr[td]'):
+        cells = [td.text_content().strip() for td in tr.xpath('./td')]
+        if not cells:
             continue
+        labels.append(cells[0].translate(LABEL_CHARS).strip())
 
-    return results
+        # Pad short rows (and trim long ones) to the header, as read_html did
+        values = cells[1:len(columns) + 1]
+        rows.append(values + [""] * (len(columns) - len(values)))
 
-def clean_val(val):
-    if val is None or pd.isna(val):
-        return None
-    return float(val)
+    return pd.DataFrame(rows, index=labels, columns=columns, dtype=object)
+
+
+def clean_table(df):
+    # Strip thousands separators, % and stray spaces, then convert every
+    # cell in one flat to_numeric call rather than once per column
+    cells = pd.Series(df.to_numpy().ravel(), dtype=object)
+    cells = cells.str.replace(r'[,%+\xa0]', '', regex=True)
+    values = pd.to_numeric(cells, errors='coerce').to_numpy(dtype=float)
+    return pd.DataFrame(values.reshape(df.shape), index=df.index, columns=df.columns)
+
+
+def calculate_ratios(bs, pnl, company):
+    # Skip garbage columns and years the P&L doesn't report
+    cols = [
+        col for col in bs.columns
+        if not (pd.isna(col) or str(col).strip() == "") and col in pnl.columns
+    ]
+
+    equity_key = "Equity Capital" if "Equity Capital" in bs.index else "Equity Share Capital"
+    if equity_key not in bs.index and "Share Capital" in bs.index:
+        equity_key = "Share Capital"
+
+    # P&L keys
+    sales_key = "Sales" if "Sales" in pnl.index else "Revenue"
+    opm_key = "OPM %" if "OPM %" in pnl.index else "OPM"
+    pbt_key = "Profit before tax" if "Profit before tax" in pnl.index else None
+    int_key = "Interest" if "Interest" in pnl.index else None
+
+    if not cols or any(k not in bs.index for k in ("Borrowings", equity_key, "Reserves")) \
+            or any(k not in pnl.index for k in (sales_key, "Operating Profit")):
+        return []
+
+    # Pull every row we need out as a float array in one lookup per frame
+    bs_keys = ["Borrowings", equity_key, "Reserves"]
+    pnl_keys = [
+        k for k in (sales_key, "Operating Profit", opm_key, pbt_key, int_key, "Tax %", "Net Profit")
+        if k in pnl.index
+    ]
+    bs_rows = dict(zip(bs_keys, bs.loc[bs_keys, cols].to_numpy(dtype=float)))
+    pnl_rows = dict(zip(pnl_keys, pnl.loc[pnl_keys, cols].to_numpy(dtype=float)))
+
+    nan = np.full(len(cols), np.nan)
+
+    debt = bs_rows["Borrowings"]
+    equity_cap = bs_rows[equity_key]
+    reserves = bs_rows["Reserves"]
+    revenue = pnl_rows[sales_key]
+    op_profit = pnl_rows["Operating Profit"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        equity = equity_cap + reserves
+        de = np.where(equity != 0, debt / equity, np.nan)
+
+        # OPM: screener reports it as a percentage (negative in loss
+        # years), so always scale it to a fraction; derive it if missing
+        opm_raw = pnl_rows.get(opm_key, nan)
+        opm = np.where(
+            np.isnan(opm_raw),
+            np.where(revenue != 0, op_profit / revenue, np.nan),
+            opm_raw / 100.0,
+        )
+
+        # ROCE
+        # Approx Capital Employed = Equity + Debt.
+        # ROCE = EBIT / (Equity + Debt).
+        # EBIT = Profit before tax + Interest.
+        capital_employed = equity + debt
+        if pbt_key and int_key:
+            ebit = pnl_rows[pbt_key] + pnl_rows[int_key]
+            roce = np.where(capital_employed > 0, ebit / capital_employed, np.nan)
+        else:
+            roce = nan
+
+    zeros = [0] * len(cols)
+
+    fields = {
+        "Debt_to_Equity": clean_vals(de),
+        "Operating_Profit_Margin": clean_vals(opm),
+        "ROCE": clean_vals(roce),
+
+        # Raw Data for Formulas
+        "Raw_Borrowings": clean_vals(debt),
+        "Raw_Equity_Share_Capital": clean_vals(equity_cap),
+        "Raw_Reserves": clean_vals(reserves),
+        "Raw_Sales": clean_vals(revenue),
+        "Raw_Operating_Profit": clean_vals(op_profit),
+        "Raw_Profit_before_tax": clean_vals(pnl_rows[pbt_key]) if pbt_key else zeros,
+        "Raw_Interest": clean_vals(pnl_rows[int_key]) if int_key else zeros,
+        "Raw_Tax_Percent": clean_vals(pnl_rows["Tax %"]) if "Tax %" in pnl_rows else zeros,
+        "Raw_Net_Profit": clean_vals(pnl_rows["Net Profit"]) if "Net Profit" in pnl_rows else zeros,
+    }
+
+    return [
+        {"Company": company, "Month": col, **dict(zip(fields, values))}
+        for col, *values in zip(cols, *fields.values())
+    ]
+
+def clean_vals(arr):
+    return [None if np.isnan(v) else v for v in arr.tolist()]